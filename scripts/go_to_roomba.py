@@ -61,6 +61,8 @@ if __name__ == '__main__':
     # publish and subscribe over ROS.
     rospy.init_node('go_to_roomba_abstract')
     _roomba_status_sub = rospy.Subscriber('roombas',
-                     OdometryArray, _receive_roomba_status)
+                     OdometryArray, _receive_roomba_status,
+                     queue_size=1, buff_size=2**24, tcp_nodelay=True)
     go_to_roomba_land()
-    rospy.spin()
+    _roomba_status_sub.unregister()
+    rospy.signal_shutdown('mission complete')
@@ -0,0 +1,448 @@
+#! /usr/bin/env python
+import copy
+import math
+import numpy as np
+import rospy
+import threading
+import actionlib
+
+from iarc7_msgs.msg import OdometryArray
+from nav_msgs.msg import Odometry
+from iarc7_motion.msg import QuadMoveGoal, QuadMoveAction
+from iarc7_safety.SafetyClient import SafetyClient
+from iarc7_abstract.arena_position_estimator import ArenaPositionEstimator
+
+# Use the motion planner instead of raw velocity goals to reach search points
+USE_PLANNER = False
+
+# Height to translate at while searching, in meters
+TRANSLATION_HEIGHT = 1.5
+
+# Velocity to translate at while searching, in m/s
+SEARCH_VELOCITY = 0.5
+
+# Distance from a roomba at which a track task is requested
+# instead of a go_to_roomba task, in meters
+MIN_GOTO_DISTANCE = 0.5
+
+# Arrival tolerance for a search point, in meters
+SEARCH_POINT_TOLERANCE = 0.5
+
+# Time allowed to reach a single search point, in seconds
+SEARCH_POINT_TIMEOUT = rospy.Duration(10.0)
+
+# Mission 7a flight time limit, in seconds
+MAX_FLIGHT_DURATION = rospy.Duration(600.0)
+
+# Minimum time before an identical goal is sent again, in seconds
+GOAL_RESEND_PERIOD = rospy.Duration(0.25)
+
+# Yaw change at which a tracked roomba is considered to be turning, in radians
+ROOMBA_TURN_THRESHOLD = math.pi / 4.0
+
+# Points (in arena coordinates) visited while searching for roombas,
+# kept contiguous float32 so rows can be handed around cheaply
+SEARCH_POINTS = np.asarray(((-5.0, -5.0),
+                            (-5.0,  0.0),
+                            (-5.0,  5.0),
+                            ( 0.0,  5.0),
+                            ( 0.0,  0.0),
+                            ( 0.0, -5.0),
+                            ( 5.0, -5.0),
+                            ( 5.0,  0.0),
+                            ( 5.0,  5.0)), dtype=np.float32)
+
+# SEARCH_POINTS transformed into the map frame, maintained by
+# refresh_search_points_map once the arena position estimator is up
+SEARCH_POINTS_MAP = None
+
+def refresh_search_points_map():
+    '''Re-transform the search points into the map frame
+
+    The arena boundary estimate shifts as /floor_detector/boundaries
+    corrections arrive, so arena_to_map is a live transform and the
+    cached array has to be refreshed rather than computed once.
+    '''
+    global SEARCH_POINTS_MAP
+    SEARCH_POINTS_MAP = np.asarray(
+            [arena_position_estimator.arena_to_map(point)
+             for point in SEARCH_POINTS],
+            dtype=np.float32)
+
+# Prototype goals, shallow-copied and patched per request so genmsg's
+# per-field default initialization only runs once per movement type
+_xyz_goal_template = QuadMoveGoal(movement_type="xyztranslate",
+                                  z_position=TRANSLATION_HEIGHT)
+_velocity_goal_template = QuadMoveGoal(movement_type="velocity_test",
+                                       z_position=TRANSLATION_HEIGHT)
+_goto_goal_template = QuadMoveGoal(movement_type="go_to_roomba")
+_track_goal_template = QuadMoveGoal(movement_type="track_roomba",
+                                    x_overshoot=0.0,
+                                    y_overshoot=0.0)
+
+def roomba_distance(roomba, odom):
+    '''Distance from the drone to a roomba, in meters'''
+    roomba_position = roomba.pose.pose.position
+    position = odom.pose.pose.position
+    return math.hypot(roomba_position.x - position.x,
+                      roomba_position.y - position.y)
+
+def target_roomba_law(roombas, odom):
+    '''Pick the target roomba, currently the closest one to the drone'''
+    if len(roombas) == 0:
+        return None
+    xs = np.fromiter((roomba.pose.pose.position.x for roomba in roombas),
+                     dtype=np.float64, count=len(roombas))
+    ys = np.fromiter((roomba.pose.pose.position.y for roomba in roombas),
+                     dtype=np.float64, count=len(roombas))
+    # Only the argmin matters, so skip the square root
+    d2 = ((xs - odom.pose.pose.position.x)**2
+          + (ys - odom.pose.pose.position.y)**2)
+    return roombas[int(np.argmin(d2))]
+
+def roomba_yaw(roomba):
+    '''Heading of a roomba in the map frame, in radians'''
+    orientation = roomba.pose.pose.orientation
+    # Closed form yaw extraction, equivalent to
+    # euler_from_quaternion(...)[2] without building the 4x4 matrix
+    return math.atan2(
+            2.0 * (orientation.w * orientation.z
+                   + orientation.x * orientation.y),
+            1.0 - 2.0 * (orientation.y * orientation.y
+                         + orientation.z * orientation.z))
+
+def construct_xyz_goal(point_index):
+    '''Goal that asks the planner to translate to a search point'''
+    map_pos = SEARCH_POINTS_MAP[point_index]
+    goal = copy.copy(_xyz_goal_template)
+    goal.x_position = float(map_pos[0])
+    goal.y_position = float(map_pos[1])
+    return goal
+
+def construct_velocity_goal(arena_pos, odom):
+    '''Goal that translates towards a point in the arena at SEARCH_VELOCITY'''
+    position = odom.pose.pose.position
+    dx = arena_pos[0] - position.x
+    dy = arena_pos[1] - position.y
+    distance = math.hypot(dx, dy)
+    goal = copy.copy(_velocity_goal_template)
+    goal.x_velocity = SEARCH_VELOCITY * dx / distance
+    goal.y_velocity = SEARCH_VELOCITY * dy / distance
+    return goal
+
+def construct_goto_roomba_goal(roomba_id):
+    '''Goal that asks the planner to fly over to a roomba'''
+    goal = copy.copy(_goto_goal_template)
+    goal.frame_id = roomba_id
+    return goal
+
+def construct_track_goal(roomba_id):
+    '''Goal that tracks a roomba until canceled'''
+    goal = copy.copy(_track_goal_template)
+    goal.frame_id = roomba_id
+    return goal
+
+class Mission7(object):
+    def __init__(self):
+        self._avail_roombas = None
+        self._roomba_by_id = {}
+        self._odom = None
+
+        # Notified whenever a new roomba or odometry message arrives so
+        # the mission loops can sleep until there is something to look at
+        self._msg_cv = threading.Condition()
+
+        # Terminal state of the last tracked goal, filled in by _on_done
+        self._goal_done_state = None
+        self._goal_done_evt = threading.Event()
+
+        # Dead-band on duplicate goal sends
+        self._last_goal_signature = None
+        self._last_goal_time = rospy.Time(0)
+
+        # Set once the first odometry arrives / while roombas are in
+        # view, so consumers check a flag instead of re-testing the
+        # message references every iteration
+        self._odom_ready = threading.Event()
+        self._roombas_ready = threading.Event()
+
+        # Shared by every loop that still sleeps at a fixed rate
+        self._rate = rospy.Rate(30)
+
+        # Search points already flown to in the current pass
+        self._visited = np.zeros(len(SEARCH_POINTS), dtype=bool)
+
+        self._roomba_sub = rospy.Subscriber('/roombas',
+                                            OdometryArray,
+                                            self.roomba_callback,
+                                            queue_size=1,
+                                            buff_size=2**24,
+                                            tcp_nodelay=True)
+        self._odom_sub = rospy.Subscriber('/odometry/filtered/',
+                                          Odometry,
+                                          self.odom_callback,
+                                          queue_size=1,
+                                          buff_size=2**24,
+                                          tcp_nodelay=True)
+
+        # The default feedback/result subscriber queue length of 1 can
+        # drop result messages when goals transition quickly, e.g. a
+        # cancel followed by an immediate send. actionlib reads this
+        # parameter when the client is constructed.
+        rospy.set_param('actionlib_client_sub_queue_size', 10)
+
+        # Creates the SimpleActionClient, passing the type of the action
+        # (QuadMoveAction) to the constructor. (Look in the action folder)
+        self._client = actionlib.SimpleActionClient('motion_planner_server',
+                                                    QuadMoveAction)
+
+        # Waits until the action server has started up and started
+        # listening for goals.
+        self._client.wait_for_server()
+
+    def teardown(self):
+        '''Release the subscribers and their receive threads'''
+        self._roomba_sub.unregister()
+        self._odom_sub.unregister()
+
+    def roomba_callback(self, data):
+        self._avail_roombas = data.data
+        self._roomba_by_id = {roomba.child_frame_id: roomba
+                              for roomba in data.data}
+        if len(data.data) > 0:
+            self._roombas_ready.set()
+        else:
+            self._roombas_ready.clear()
+        with self._msg_cv:
+            self._msg_cv.notify_all()
+
+    def odom_callback(self, data):
+        self._odom = data
+        self._odom_ready.set()
+        with self._msg_cv:
+            self._msg_cv.notify_all()
+
+    def _on_done(self, state, result):
+        self._goal_done_state = state
+        self._goal_done_evt.set()
+        with self._msg_cv:
+            self._msg_cv.notify_all()
+
+    def _send_tracked_goal(self, goal):
+        '''Send a goal whose completion is reported through _on_done
+
+        While the previous goal is still in flight, a goal matching it
+        is dropped until GOAL_RESEND_PERIOD has elapsed, so state
+        machine re-entry does not flood the action topic with
+        near-duplicate goals. Once a goal finishes or is canceled the
+        dead-band no longer applies.
+        '''
+        signature = (goal.movement_type,
+                     round(goal.x_position, 2),
+                     round(goal.y_position, 2),
+                     goal.frame_id)
+        now = rospy.Time.now()
+        if (signature == self._last_goal_signature
+                and not self._goal_done_evt.is_set()
+                and now - self._last_goal_time < GOAL_RESEND_PERIOD):
+            return
+        self._last_goal_signature = signature
+        self._last_goal_time = now
+        self._goal_done_evt.clear()
+        self._goal_done_state = None
+        self._client.send_goal(goal, done_cb=self._on_done)
+
+    def _cancel_tracked_goal(self):
+        '''Cancel the current goal and allow its immediate re-send'''
+        self._client.cancel_goal()
+        self._last_goal_signature = None
+
+    def wait_for_roomba(self):
+        '''Block until odometry and at least one roomba are available'''
+        while not rospy.is_shutdown():
+            if self._odom_ready.is_set() and self._roombas_ready.is_set():
+                return
+            with self._msg_cv:
+                self._msg_cv.wait(timeout=1.0/30)
+
+    def begin_translate(self, point_index):
+        '''Start a translation towards a search point'''
+        if USE_PLANNER:
+            self._client.send_goal(construct_xyz_goal(point_index))
+        else:
+            self._client.send_goal(
+                    construct_velocity_goal(SEARCH_POINTS[point_index],
+                                            self._odom))
+
+    def _next_search_point(self):
+        '''Pick the nearest search point that has not been visited yet'''
+        if self._visited.all():
+            self._visited[:] = False
+        position = self._odom.pose.pose.position
+        distances = np.linalg.norm(
+                SEARCH_POINTS_MAP - (position.x, position.y), axis=1)
+        index = int(np.argmin(np.where(self._visited, np.inf, distances)))
+        self._visited[index] = True
+        return index
+
+    def search_for_roomba(self):
+        '''Fly the search pattern until a roomba is seen
+
+        Search points are visited nearest-first so the drone never
+        backtracks across the arena between points.
+
+        Returns True if a roomba was found, False if the pattern was
+        exhausted without seeing one.
+        '''
+        # Velocity goals and the arrival check both need odometry;
+        # wait with a timeout so shutdown can still interrupt us
+        while not rospy.is_shutdown():
+            if self._odom_ready.wait(timeout=1.0/30):
+                break
+        # Pick up any boundary corrections since the last pass
+        refresh_search_points_map()
+        for _ in range(len(SEARCH_POINTS)):
+            i = self._next_search_point()
+            self.begin_translate(i)
+            point_start_time = rospy.Time.now()
+            while not rospy.is_shutdown():
+                if self._roombas_ready.is_set():
+                    self._client.cancel_goal()
+                    rospy.loginfo('Mission7: found roomba while searching')
+                    return True
+                position = self._odom.pose.pose.position
+                dx = SEARCH_POINTS_MAP[i][0] - position.x
+                dy = SEARCH_POINTS_MAP[i][1] - position.y
+                if math.hypot(dx, dy) < SEARCH_POINT_TOLERANCE:
+                    break
+                if (rospy.Time.now() - point_start_time
+                        > SEARCH_POINT_TIMEOUT):
+                    rospy.logwarn('Mission7: timed out reaching search point')
+                    break
+                self._rate.sleep()
+            self._client.cancel_goal()
+        return False
+
+    def track_roomba_to_completion(self):
+        '''Chase the target roomba until the track task finishes
+
+        Returns True if the roomba was successfully tracked.
+        '''
+        # Guarantees odometry and the roomba list exist before the
+        # state machine dereferences either
+        self.wait_for_roomba()
+        state = 0
+        target_id = None
+        track_start_yaw = None
+        while not rospy.is_shutdown():
+            # Snapshot the latest odometry once per iteration; the
+            # callback only ever swaps the reference, so this is a
+            # consistent message and attribute reads stay local
+            odom = self._odom
+            if state == 0:
+                # Pick a target and start moving towards it
+                target_roomba = target_roomba_law(self._avail_roombas, odom)
+                if target_roomba is None:
+                    return False
+                target_id = target_roomba.child_frame_id
+                if roomba_distance(target_roomba, odom) < MIN_GOTO_DISTANCE:
+                    self._send_tracked_goal(construct_track_goal(target_id))
+                    track_start_yaw = roomba_yaw(target_roomba)
+                    state = 2
+                else:
+                    self._send_tracked_goal(
+                            construct_goto_roomba_goal(target_id))
+                    state = 1
+            elif state == 1:
+                # Flying over to the target
+                roomba = self._roomba_by_id.get(target_id)
+                if roomba is None:
+                    self._cancel_tracked_goal()
+                    state = 0
+                elif roomba_distance(roomba, odom) < MIN_GOTO_DISTANCE:
+                    # send_goal preempts the in-flight goto goal, so an
+                    # explicit cancel beforehand would only risk the
+                    # result message being dropped
+                    self._send_tracked_goal(construct_track_goal(target_id))
+                    track_start_yaw = roomba_yaw(roomba)
+                    state = 2
+                elif self._goal_done_evt.is_set():
+                    state = 0
+            elif state == 2:
+                # Tracking the target
+                roomba = self._roomba_by_id.get(target_id)
+                if roomba is None:
+                    self._cancel_tracked_goal()
+                    state = 0
+                else:
+                    # Wrap the difference so headings straddling the
+                    # +/-pi boundary do not read as a full turn
+                    yaw_diff = roomba_yaw(roomba) - track_start_yaw
+                    yaw_change = abs(math.atan2(math.sin(yaw_diff),
+                                                math.cos(yaw_diff)))
+                    if yaw_change > ROOMBA_TURN_THRESHOLD:
+                        # The roomba is turning, break off and retarget
+                        self._cancel_tracked_goal()
+                        state = 0
+                    elif self._goal_done_evt.is_set():
+                        # see http://docs.ros.org/api/actionlib_msgs/html/msg/GoalStatus.html
+                        # 3: SUCCEEDED
+                        return self._goal_done_state == 3
+            # Wake up on new messages, with a timeout so action state
+            # changes are still noticed promptly
+            with self._msg_cv:
+                self._msg_cv.wait(timeout=1.0/30)
+        return False
+
+    def attempt_mission7(self):
+        # Test takeoff
+        goal = QuadMoveGoal(movement_type="takeoff")
+        # Sends the goal to the action server.
+        self._client.send_goal(goal)
+        # Waits for the server to finish performing the action.
+        self._client.wait_for_result()
+        if rospy.is_shutdown(): return
+        rospy.logwarn("Takeoff success: {}".format(self._client.get_result()))
+
+        flight_deadline = rospy.Time.now() + MAX_FLIGHT_DURATION
+        while not rospy.is_shutdown():
+            if rospy.Time.now() > flight_deadline:
+                rospy.logwarn('Mission7: out of flight time')
+                break
+            if self._roombas_ready.is_set():
+                result = self.track_roomba_to_completion()
+                rospy.logwarn("Track roomba success: {}".format(result))
+            else:
+                self.search_for_roomba()
+
+        goal = QuadMoveGoal(movement_type="land")
+        # Sends the goal to the action server.
+        self._client.send_goal(goal)
+        # Waits for the server to finish performing the action.
+        self._client.wait_for_result()
+        if rospy.is_shutdown(): return
+        rospy.logwarn("Land success: {}".format(self._client.get_result()))
+
+if __name__ == '__main__':
+    # Initializes a rospy node so that the SimpleActionClient can
+    # publish and subscribe over ROS.
+    rospy.init_node('mission7_abstract')
+
+    safety_client = SafetyClient('mission7_abstract')
+    # Since this abstract is top level in the control chain there is no need to check
+    # for a safety state. We can also get away with not checking for a fatal state since
+    # all nodes below will shut down.
+    assert(safety_client.form_bond())
+
+    arena_position_estimator = ArenaPositionEstimator()
+
+    refresh_search_points_map()
+
+    if not rospy.is_shutdown():
+        mission7 = Mission7()
+        mission7.attempt_mission7()
+        # The mission is over, so drop the subscribers and shut down
+        # instead of spinning with live receive threads forever
+        mission7.teardown()
+
+    rospy.signal_shutdown('mission complete')